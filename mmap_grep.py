@@ -6,26 +6,122 @@ Loads files into memory once, then searches super fast.
 
 import os
 import mmap
+import hashlib
 import time
 import subprocess
+import tempfile
+import multiprocessing
+import zipfile
 from pathlib import Path
-from queue import Queue
-from dataclasses import dataclass
+from queue import Queue, Empty
+from dataclasses import dataclass, field
 from typing import List, Dict, Optional
 import threading
 import re
-from collections import Counter
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from functools import lru_cache, partial
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
 
+import numpy as np
 
-@dataclass
+try:
+    import re2  # google-re2: linear-time DFA engine, used when installed
+except ImportError:
+    re2 = None
+
+try:
+    from numba import njit  # compiles the literal scanner to GIL-free code
+except ImportError:
+    njit = None
+
+
+# Bytes that make a pattern a regex rather than a plain literal
+_REGEX_META = frozenset(b'.^$*+?{}[]\\|()')
+
+# \A, \Z and \z anchor to the whole string, which only means start/end of
+# line when the regex runs on one line at a time
+_STRING_ANCHOR = re.compile(rb'(?<!\\)(?:\\\\)*\\[AZz]')
+
+# ASCII bytes that count as word characters. Non-ASCII ones depend on the
+# UTF-8 character they're part of, see _word_mask.
+_WORD_BYTES = np.zeros(256, dtype=bool)
+_WORD_BYTES[[*range(0x30, 0x3A), *range(0x41, 0x5B), *range(0x61, 0x7B), 0x5F]] = True
+
+# Extensions load() never reads, in lowercase
+_SKIP_EXTS = frozenset(['.png', '.jpg', '.jpeg', '.gif', '.ico', '.pdf', '.zip', '.tar',
+                        '.gz', '.exe', '.dll', '.so', '.dylib'])
+
+# ASCII lowercasing table, and one that leaves bytes alone
+_LOWER = np.arange(256, dtype=np.uint8)
+_LOWER[0x41:0x5B] += 0x20
+_SAME = np.arange(256, dtype=np.uint8)
+
+# FNV-1a parameters for hashing words
+_FNV_OFFSET = np.uint64(0xCBF29CE484222325)
+_FNV_PRIME = np.uint64(0x100000001B3)
+
+# Longest word _hash_words hashes in its vectorized loop, which takes a
+# step per byte of the longest word
+_HASH_VECTOR_MAX = 64
+
+
+@dataclass(slots=True)
 class Codebase:
     name: str
     path: str
     files: Dict[str, mmap.mmap]  # file -> mmap
-    stats: Dict[str, dict]  # file -> info
+    # Per-file stats as parallel arrays, row i is paths[i]
+    paths: List[str]
+    sizes: np.ndarray  # int64
+    mtimes: np.ndarray  # float64
+    lines: np.ndarray  # int64
+    words: np.ndarray  # int64
+    ext_ids: np.ndarray  # int16, index into ext_table
+    ext_table: List[str]
+    trigram_index: np.ndarray  # uint64, sorted (trigram code << 32 | row) of every file's trigrams
+    newlines: Dict[str, np.ndarray] = field(default_factory=dict)  # file -> newline offsets
+    rows: Dict[str, int] = field(init=False)  # file -> row
+    
+    def __post_init__(self):
+        self.rows = {fpath: i for i, fpath in enumerate(self.paths)}
+    
+    def rows_with(self, required: np.ndarray) -> np.ndarray:
+        """Rows, in order, of the files that contain every required trigram code."""
+        keys = required.astype(np.uint64) << np.uint64(32)
+        bounds = np.searchsorted(self.trigram_index, np.concatenate((keys, keys + (np.uint64(1) << np.uint64(32)))))
+        lo, hi = bounds[:len(keys)], bounds[len(keys):]
+        
+        # Start from the rarest trigram, then drop rows missing each other one
+        rows = None
+        for i in np.argsort(hi - lo, kind='stable').tolist():
+            found = self.trigram_index[lo[i]:hi[i]] & np.uint64(0xFFFFFFFF)
+            if rows is None:
+                rows = found
+            else:
+                idx = np.minimum(np.searchsorted(found, rows), len(found) - 1)
+                rows = rows[found[idx] == rows]
+            if not len(rows):
+                break
+        return rows.astype(np.intp)
+    
+    def info(self, row: int) -> 'FileInfo':
+        """FileInfo for one row of the stats arrays."""
+        return FileInfo(
+            file=self.paths[row],
+            size=int(self.sizes[row]),
+            ext=self.ext_table[self.ext_ids[row]],
+            mtime=float(self.mtimes[row]),
+            lines=int(self.lines[row]),
+            words=int(self.words[row])
+        )
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class SearchRequest:
     codebase: str
     pattern: str
@@ -33,15 +129,20 @@ class SearchRequest:
     max_results: Optional[int] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class SearchResult:
     file: str
     line: int
-    text: str
+    raw: bytes  # matching line, undecoded
     pos: int
+    
+    @property
+    def text(self) -> str:
+        """Matching line, decoded only when someone asks for it."""
+        return self.raw.decode('utf-8', errors='replace').strip()
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class FileInfo:
     file: str
     size: int
@@ -51,7 +152,7 @@ class FileInfo:
     words: int
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Stats:
     files: int
     size: int
@@ -67,12 +168,27 @@ class Stats:
 class FastGrep:
     """Super fast grep using memory mapping."""
     
+    RE_CACHE_SIZE = 256
+    PARALLEL_MIN_BYTES = 64 * 1024 * 1024  # smaller codebases search faster in-process
+    BATCH_BYTES = 8 * 1024 * 1024  # work handed to a search process at a time
+    CACHE_DIR = Path.home() / '.cache' / 'fastgrep'
+    BATCH_SIZE = 16  # queued searches the worker runs at once
+    SPECIALIZE_AFTER = 2  # searches for a literal before it gets its own scanner
+    SPECIALIZE_MIN_BYTES = 512 * 1024 * 1024  # or bytes to scan in one search
+    
     def __init__(self):
         self.codebases = {}
         self.queue = Queue()
         self.running = False
         self.worker = None
-        self.word_re = re.compile(r'\b\w+\b')
+        self.workers = os.cpu_count() or 1
+        self.pool = None  # search processes, started on first big search
+        self.threads = None  # search threads for the Numba scanner
+        self.lock = threading.Lock()  # guards the matcher cache and pools
+        self._stats_cache = {}  # name -> (file keys, Stats)
+        self._word_cache = {}  # (path, mtime, size) -> _word_counts() table
+        self._re_cache = OrderedDict()  # (pattern, case_sensitive) -> matcher
+        self._literal_uses = OrderedDict()  # literal -> searches so far
         
     def load(self, name: str, path: str, exts: Optional[List[str]] = None) -> bool:
         """Load a codebase into memory."""
@@ -86,70 +202,143 @@ class FastGrep:
                    '.sh', '.sample', '.yml', '.yaml', '.json', '.xml']
         
         files = {}
-        stats = {}
-        root = Path(path)
+        trigrams = []
+        rows = []  # (size, mtime, lines, words, ext) per file
+        wanted = frozenset(exts)
         
         print(f"Loading {name} from {path}...")
         
-        # Get all files, skip binary stuff
+        # Get all files, skip binary stuff and filter by extensions if specified
         all_files = []
-        for f in root.rglob('*'):
-            if f.is_file():
-                if f.suffix.lower() in ['.png', '.jpg', '.jpeg', '.gif', '.ico', '.pdf', '.zip', '.tar', '.gz', '.exe', '.dll', '.so', '.dylib']:
-                    continue
-                all_files.append(f)
+        for fpath, stat_info in _walk(path):
+            ext = _suffix(fpath)
+            if ext.lower() in _SKIP_EXTS or (wanted and ext not in wanted):
+                continue
+            all_files.append((fpath, stat_info))
         
-        # Filter by extensions if specified
-        if exts:
-            all_files = [f for f in all_files if f.suffix in exts]
+        # Counts and trigrams from the last load of this path, if any
+        cache_file = self.CACHE_DIR / (hashlib.sha1(os.path.abspath(path).encode()).hexdigest() + '.index.npz')
+        cached = _read_index_cache(cache_file)
         
-        # Load each file into memory
-        for f in all_files:
-            try:
-                stat_info = f.stat()
-                fpath = str(f)
-                
-                with open(f, 'r+b') as file:
-                    if file.seek(0, 2) > 0:  # Check if not empty
-                        file.seek(0)
-                        mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
-                        try:
-                            mm.madvise(mmap.MADV_WILLNEED)
-                        except:
-                            pass  # Some systems don't support this
-                        
-                        files[fpath] = mm
-                        
-                        # Count stuff
-                        content = mm.read()
-                        lines = content.split(b'\n')
-                        words = self.word_re.findall(content.decode('utf-8', errors='replace'))
-                        
-                        stats[fpath] = {
-                            'size': stat_info.st_size,
-                            'ext': f.suffix,
-                            'mtime': stat_info.st_mtime,
-                            'lines': len(lines),
-                            'words': len(words)
-                        }
-                            
-            except Exception as e:
-                print(f"Couldn't load {f}: {e}")
+        # Map every file up front so readahead is queued for all of them,
+        # like a batch of async reads, before anything touches the pages
+        mapped = [m for m in map(self._map_file, all_files) if m]
+        
+        # Then count them in parallel, numpy drops the GIL while counting
+        with ThreadPoolExecutor(max_workers=self.workers) as ex:
+            for loaded in ex.map(partial(self._count_file, cached=cached), mapped):
+                if loaded:
+                    fpath, mm, row, tris = loaded
+                    files[fpath] = mm
+                    trigrams.append(tris)
+                    rows.append(row)
         
         if not files:
             print(f"No files found in {path}")
             return False
-            
-        self.codebases[name] = Codebase(
+        
+        # All the trigrams end to end, then sorted by code for lookups
+        offsets = np.zeros(len(trigrams) + 1, dtype=np.int64)
+        np.cumsum([len(tris) for tris in trigrams], out=offsets[1:])
+        trigrams = np.concatenate(trigrams)
+        file_rows = np.repeat(np.arange(len(rows), dtype=np.uint64), np.diff(offsets))
+        
+        ext_table = list(dict.fromkeys(row[4] for row in rows))
+        ext_ids = {ext: i for i, ext in enumerate(ext_table)}
+        cb = Codebase(
             name=name,
             path=path,
             files=files,
-            stats=stats
+            paths=list(files),
+            sizes=np.array([row[0] for row in rows], dtype=np.int64),
+            mtimes=np.array([row[1] for row in rows], dtype=np.float64),
+            lines=np.array([row[2] for row in rows], dtype=np.int64),
+            words=np.array([row[3] for row in rows], dtype=np.int64),
+            ext_ids=np.array([ext_ids[row[4]] for row in rows], dtype=np.int16),
+            ext_table=ext_table,
+            trigram_index=np.sort((trigrams.astype(np.uint64) << np.uint64(32)) | file_rows)
         )
         
+        # Only rewrite the cache if something changed
+        if len(cached) != len(rows) or any(
+                cached.get(fpath, ())[:2] != (row[1], row[0]) for fpath, row in zip(files, rows)):
+            _write_index_cache(cache_file, cb, trigrams, offsets)
+        
+        # Forget word counts for files that changed since the last load
+        old = self.codebases.get(name)
+        if old is not None:
+            fresh = set(zip(cb.paths, cb.mtimes.tolist(), cb.sizes.tolist()))
+            for key in zip(old.paths, old.mtimes.tolist(), old.sizes.tolist()):
+                if key not in fresh:
+                    self._word_cache.pop(key, None)
+        
+        self.codebases[name] = cb
+        self._stats_cache.pop(name, None)
+        
         print(f"Loaded {len(files)} files for {name}")
         return True
     
+    def _map_file(self, entry: tuple):
+        """Map one (file, stat) from _walk() and ask the kernel to start reading it in.
+        
+        Returns (file, stat, mmap), or None for empty or unreadable files.
+        """
+        f, stat_info = entry
+        try:
+            if stat_info.st_size == 0:  # Can't map empty files
+                return None
+            
+            # Skip the atime update where we're allowed to (only the owner is)
+            try:
+                fd = os.open(f, os.O_RDONLY | getattr(os, 'O_NOATIME', 0))
+            except PermissionError:
+                fd = os.open(f, os.O_RDONLY)
+            try:
+                mm = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+            finally:
+                os.close(fd)
+            
+            # Files are scanned front to back, so ask for big readahead and,
+            # for larger files, huge pages to cut TLB misses
+            advice = [getattr(mmap, 'MADV_WILLNEED', None), getattr(mmap, 'MADV_SEQUENTIAL', None)]
+            if stat_info.st_size >= 2 * 1024 * 1024:
+                advice.append(getattr(mmap, 'MADV_HUGEPAGE', None))
+            for flag in advice:
+                if flag is None:
+                    continue
+                try:
+                    mm.madvise(flag)
+                except:
+                    pass  # Some systems don't support this
+            return f, stat_info, mm
+        
+        except Exception as e:
+            print(f"Couldn't load {f}: {e}")
+            return None
+    
+    def _count_file(self, mapped: tuple, cached: Dict[str, tuple]):
+        """Count a mapped file and index its trigrams.
+        
+        Returns (path, mmap, (size, mtime, lines, words, ext), trigrams) or
+        None. Everything is taken from cached instead when the file's mtime
+        and size haven't changed.
+        """
+        fpath, stat_info, mm = mapped
+        try:
+            hit = cached.get(fpath)
+            if hit and hit[:2] == (stat_info.st_mtime, stat_info.st_size):
+                _, _, lines, words, tris = hit
+            else:
+                # Count stuff
+                lines, words, tris = _index_file(mm)
+            
+            return fpath, mm, (stat_info.st_size, stat_info.st_mtime, lines, words, _suffix(fpath)), tris
+        
+        except Exception as e:
+            print(f"Couldn't load {fpath}: {e}")
+            mm.close()
+            return None
+    
     def unload(self, name: str):
         """Unload a codebase."""
         if name in self.codebases:
@@ -157,6 +346,15 @@ class FastGrep:
             for mm in cb.files.values():
                 mm.close()
             del self.codebases[name]
+            self._stats_cache.pop(name, None)
+            for key in zip(cb.paths, cb.mtimes.tolist(), cb.sizes.tolist()):
+                self._word_cache.pop(key, None)
+            if not self.codebases and self.pool:
+                self.pool.shutdown()
+                self.pool = None
+            if not self.codebases and self.threads:
+                self.threads.shutdown()
+                self.threads = None
             print(f"Unloaded {name}")
     
     
@@ -168,58 +366,84 @@ class FastGrep:
         
         cb = self.codebases[name]
         
+        # Reuse the last result if no file has changed since
+        keys = list(zip(cb.paths, cb.mtimes.tolist(), cb.sizes.tolist()))
+        cached = self._stats_cache.get(name)
+        if cached and cached[0] == keys:
+            return cached[1]
+        
         # Count everything
-        total_files = len(cb.files)
-        total_size = sum(s['size'] for s in cb.stats.values())
-        total_lines = sum(s['lines'] for s in cb.stats.values())
-        total_words = sum(s['words'] for s in cb.stats.values())
-        
-        # File types
-        types = Counter(s['ext'] for s in cb.stats.values())
-        
-        # By extension
-        size_by_ext = {}
-        lines_by_ext = {}
-        for s in cb.stats.values():
-            ext = s['ext']
-            size_by_ext[ext] = size_by_ext.get(ext, 0) + s['size']
-            lines_by_ext[ext] = lines_by_ext.get(ext, 0) + s['lines']
-        
-        # Biggest files
-        file_infos = []
-        for fpath, s in cb.stats.items():
-            file_infos.append(FileInfo(
-                file=fpath,
-                size=s['size'],
-                ext=s['ext'],
-                mtime=s['mtime'],
-                lines=s['lines'],
-                words=s['words']
-            ))
-        
-        biggest = sorted(file_infos, key=lambda x: x.size, reverse=True)[:10]
-        
-        # Common words
-        word_count = Counter()
-        for fpath, mm in cb.files.items():
-            mm.seek(0)
-            content = mm.read().decode('utf-8', errors='replace')
-            words = self.word_re.findall(content.lower())
-            word_count.update(w for w in words if len(w) > 2)
-        
-        common_words = word_count.most_common(20)
-        
-        return Stats(
+        total_files = len(cb.paths)
+        total_size = int(cb.sizes.sum())
+        total_lines = int(cb.lines.sum())
+        total_words = int(cb.words.sum())
+        
+        # File types and totals by extension
+        n_ext = len(cb.ext_table)
+        types = np.bincount(cb.ext_ids, minlength=n_ext)
+        size_by_ext = np.bincount(cb.ext_ids, weights=cb.sizes, minlength=n_ext)
+        lines_by_ext = np.bincount(cb.ext_ids, weights=cb.lines, minlength=n_ext)
+        
+        # Biggest files. Everything tied with the 10th biggest is a candidate,
+        # then a stable sort keeps ties in load order.
+        if total_files > 10:
+            cutoff = np.partition(cb.sizes, total_files - 10)[total_files - 10]
+            top = np.flatnonzero(cb.sizes >= cutoff)
+        else:
+            top = np.arange(total_files)
+        top = top[np.argsort(-cb.sizes[top], kind='stable')][:10]
+        biggest = [cb.info(row) for row in top.tolist()]
+        
+        # Common words, counted by hash across all files. Per-file tables are
+        # kept so only changed files get recounted.
+        tables = []
+        for key, mm in zip(keys, cb.files.values()):
+            table = self._word_cache.get(key)
+            if table is None:
+                table = self._word_cache[key] = _word_counts(mm)
+            tables.append(table)
+        hashes = np.concatenate([t[0] for t in tables])
+        order = np.argsort(hashes, kind='stable')
+        hashes = hashes[order]
+        counts = np.concatenate([t[1] for t in tables])[order]
+        rows = np.repeat(np.arange(total_files), [len(t[0]) for t in tables])[order]
+        starts = np.concatenate([t[2] for t in tables])[order]
+        lengths = np.concatenate([t[3] for t in tables])[order]
+        
+        # Files are in load order and the sort is stable, so the first entry
+        # for each hash is where the word first appears
+        firsts = _run_starts(hashes)
+        totals = np.add.reduceat(counts, firsts) if len(firsts) else counts
+        if len(totals) > 20:
+            cutoff = np.partition(totals, len(totals) - 20)[len(totals) - 20]
+            top = np.flatnonzero(totals >= cutoff)
+        else:
+            top = np.arange(len(totals))
+        
+        # Most common first, ties in order of first appearance, like Counter
+        first_rows, first_starts = rows[firsts[top]], starts[firsts[top]]
+        top = top[np.lexsort((first_starts, first_rows, -totals[top]))][:20]
+        
+        common_words = []
+        for i in top.tolist():
+            mm = cb.files[cb.paths[rows[firsts[i]]]]
+            start = int(starts[firsts[i]])
+            word = mm[start:start + int(lengths[firsts[i]])].decode('utf-8', errors='replace')
+            common_words.append((word.lower(), int(totals[i])))
+        
+        result = Stats(
             files=total_files,
             size=total_size,
             lines=total_lines,
             words=total_words,
-            types=dict(types),
-            size_by_ext=size_by_ext,
-            lines_by_ext=lines_by_ext,
+            types=dict(zip(cb.ext_table, types.tolist())),
+            size_by_ext={ext: int(n) for ext, n in zip(cb.ext_table, size_by_ext)},
+            lines_by_ext={ext: int(n) for ext, n in zip(cb.ext_table, lines_by_ext)},
             biggest=biggest,
             common_words=common_words
         )
+        self._stats_cache[name] = (keys, result)
+        return result
     
     
     def file_info(self, name: str, filepath: str) -> Optional[FileInfo]:
@@ -230,19 +454,25 @@ class FastGrep:
         
         cb = self.codebases[name]
         
-        if filepath not in cb.stats:
+        if filepath not in cb.rows:
             print(f"File not found: {filepath}")
             return None
         
-        s = cb.stats[filepath]
-        return FileInfo(
-            file=filepath,
-            size=s['size'],
-            ext=s['ext'],
-            mtime=s['mtime'],
-            lines=s['lines'],
-            words=s['words']
-        )
+        return cb.info(cb.rows[filepath])
+    
+    def _matcher(self, request: SearchRequest):
+        """Get a bytes literal or compiled regex for a request."""
+        key = (request.pattern.encode('utf-8'), request.case_sensitive)
+        with self.lock:
+            matcher = self._re_cache.get(key)
+            if matcher is None:
+                matcher = _make_matcher(*key)
+                self._re_cache[key] = matcher
+                if len(self._re_cache) > self.RE_CACHE_SIZE:
+                    self._re_cache.popitem(last=False)
+            else:
+                self._re_cache.move_to_end(key)
+            return matcher
     
     def search(self, request: SearchRequest) -> List[SearchResult]:
         """Search for a pattern."""
@@ -252,40 +482,117 @@ class FastGrep:
         
         cb = self.codebases[request.codebase]
         results = []
+        limit = request.max_results
         
-        # Compile regex
-        flags = 0 if request.case_sensitive else re.IGNORECASE
         try:
-            pattern = re.compile(request.pattern.encode('utf-8'), flags)
+            matcher = self._matcher(request)
         except re.error as e:
             print(f"Bad regex: {e}")
             return []
         
-        # Search each file
-        for fpath, mm in cb.files.items():
-            mm.seek(0)
-            content = mm.read()
+        # Skip files whose trigram index rules the pattern out
+        required = _required_trigrams(request.pattern.encode('utf-8'), request.case_sensitive)
+        if len(required):
+            candidates = [cb.paths[row] for row in cb.rows_with(required).tolist()]
+        else:
+            candidates = list(cb.files)
+        
+        # The Numba scanners drop the GIL so threads can share the files, other
+        # big codebases are split across processes, small ones scanned here
+        total = sum(len(cb.files[fpath]) for fpath in candidates)
+        scanner = self._scanner(matcher, total) if _nogil(matcher) else None
+        if self.workers > 1 and len(candidates) > 1 and _nogil(matcher):
+            with self.lock:
+                if self.threads is None:
+                    self.threads = ThreadPoolExecutor(max_workers=self.workers)
+            scan = partial(_collect, matcher=matcher, limit=request.max_results, scanner=scanner)
+            scanned = zip(candidates, self.threads.map(scan, [cb.files[f] for f in candidates]))
+        elif self.workers > 1 and len(candidates) > 1 and total >= self.PARALLEL_MIN_BYTES:
+            scanned = self._scan_parallel(cb, candidates, request, matcher)
+        else:
+            scanned = ((fpath, _collect(cb.files[fpath], matcher, request.max_results, scanner))
+                       for fpath in candidates)
+        
+        for fpath, hits in scanned:
+            if not hits:
+                continue
+            mm = cb.files[fpath]
+            if limit:
+                hits = hits[:3 * (limit - len(results))]  # Only what still fits
             
-            lines = content.split(b'\n')
-            for i, line in enumerate(lines, 1):
-                match = pattern.search(line)
-                if match:
-                    try:
-                        line_str = line.decode('utf-8', errors='replace')
-                        results.append(SearchResult(
-                            file=fpath,
-                            line=i,
-                            text=line_str.strip(),
-                            pos=match.start()
-                        ))
-                        
-                        if request.max_results and len(results) >= request.max_results:
-                            return results
-                    except Exception as e:
-                        print(f"Error in {fpath}: {e}")
+            # Line numbers come from the newline index, built on first hit
+            newlines = cb.newlines.get(fpath)
+            if newlines is None:
+                newlines = cb.newlines[fpath] = _newline_index(mm)
+            line_nos = np.searchsorted(newlines, hits[0::3]) + 1
+            
+            results.extend(
+                SearchResult(fpath, line, mm[ls:le], off - ls)
+                for ls, le, off, line in zip(hits[0::3], hits[1::3], hits[2::3], line_nos.tolist())
+            )
+            if limit and len(results) >= limit:
+                return results
         
         return results
     
+    def _scanner(self, matcher, total: int):
+        """Numba scanner for a literal matcher, or None to let _collect pick.
+        
+        A scanner generated for one literal costs a few hundred ms to
+        compile, so it's only used once the literal has been searched for
+        before, or when this search has enough bytes to pay for it.
+        """
+        if not isinstance(matcher, bytes):
+            return None
+        with self.lock:
+            uses = self._literal_uses.pop(matcher, 0) + 1
+            self._literal_uses[matcher] = uses
+            if len(self._literal_uses) > self.RE_CACHE_SIZE:
+                self._literal_uses.popitem(last=False)
+        if uses >= self.SPECIALIZE_AFTER or total >= self.SPECIALIZE_MIN_BYTES:
+            return _literal_scanner(matcher)
+        return None
+    
+    def _scan_parallel(self, cb: Codebase, candidates: List[str], request: SearchRequest, matcher):
+        """Scan a codebase in the process pool, yielding (file, hits) in order.
+        
+        Workers re-open files by path and only send back packed offsets; text
+        is sliced from our own mmaps afterwards. Files a worker can't open
+        as they were loaded are scanned here with matcher instead.
+        """
+        with self.lock:
+            if self.pool is None:
+                # Not fork: we're multithreaded, and a forked worker could
+                # inherit a lock another thread held (ours, or Numba's compiler's)
+                method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                self.pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                mp_context=multiprocessing.get_context(method))
+        
+        # Batch files so each task is worth the round trip
+        batches = [[]]
+        batch_size = 0
+        for fpath in candidates:
+            row = cb.rows[fpath]
+            batches[-1].append((fpath, int(cb.sizes[row]), float(cb.mtimes[row])))
+            batch_size += len(cb.files[fpath])
+            if batch_size >= self.BATCH_BYTES:
+                batches.append([])
+                batch_size = 0
+        
+        needle = request.pattern.encode('utf-8')
+        futures = [self.pool.submit(_search_files, batch, needle,
+                                    request.case_sensitive, request.max_results)
+                   for batch in batches if batch]
+        try:
+            for batch, future in zip(batches, futures):
+                for (fpath, _, _), hits in zip(batch, future.result()):
+                    if hits is None:
+                        hits = _collect(cb.files[fpath], matcher, request.max_results)
+                    yield fpath, hits
+        finally:
+            for future in futures:
+                future.cancel()
+    
     def add_search(self, request: SearchRequest):
         """Add search to queue."""
         self.queue.put(request)
@@ -309,16 +616,994 @@ class FastGrep:
         print("Worker stopped")
     
     def _worker(self):
-        """Background worker loop."""
-        while self.running:
+        """Background worker loop.
+        
+        Takes everything queued (up to BATCH_SIZE) in one go, runs the batch
+        at once and reports each search as it completes, so a batch takes
+        about as long as its slowest search rather than the sum.
+        """
+        with ThreadPoolExecutor(max_workers=self.BATCH_SIZE) as ex:
+            while self.running:
+                try:
+                    batch = [self.queue.get(timeout=1)]
+                except Empty:
+                    continue
+                while len(batch) < self.BATCH_SIZE:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except Empty:
+                        break
+                
+                futures = {ex.submit(self.search, request): request for request in batch}
+                for future in as_completed(futures):
+                    request = futures[future]
+                    try:
+                        results = future.result()
+                        print(f"\nSearch done: '{request.pattern}' in '{request.codebase}'")
+                        print(f"Found {len(results)} matches")
+                    except Exception as e:
+                        print(f"\nSearch failed: '{request.pattern}' in '{request.codebase}': {e}")
+                    self.queue.task_done()
+
+
+def _make_matcher(needle: bytes, case_sensitive: bool):
+    """Build the matcher for a pattern: the bytes themselves if it's a plain
+    literal, a _Dfa if Numba can run it, otherwise a compiled regex."""
+    # Plain literals go straight to mmap.find, everything else is a regex
+    if case_sensitive and not _REGEX_META.intersection(needle):
+        return needle
+    flags = re.MULTILINE if case_sensitive else re.MULTILINE | re.IGNORECASE
+    regex = _compile_regex(needle, flags)
+    if njit is not None:
+        dfa = _compile_dfa(needle, flags)
+        if dfa is not None:
+            # The DFA follows re's reading of the pattern, so the columns have
+            # to come from re too or lines the dialects disagree on get lost
+            return _Dfa(re.compile(needle, flags), *dfa)
+    if _STRING_ANCHOR.search(needle) or _has_lookaround(needle, flags):
+        return _LineRegex(regex)
+    return regex
+
+
+def _has_lookaround(pattern: bytes, flags: int) -> bool:
+    """Whether a regex has a lookahead or lookbehind, which would see the
+    newlines around a line unless the regex runs on that line alone."""
+    try:
+        items = [sre_parse.parse(pattern, flags)]
+    except (re.error, RecursionError):
+        return False
+    while items:
+        item = items.pop()
+        if isinstance(item, sre_parse.SubPattern):
+            for op, av in item:
+                if op is sre_parse.ASSERT or op is sre_parse.ASSERT_NOT:
+                    return True
+                items.append(av)
+        elif isinstance(item, (tuple, list)):
+            items.extend(item)
+    return False
+
+
+def _compile_regex(pattern: bytes, flags: int):
+    """Compile a bytes regex, preferring RE2 over re.
+    
+    RE2 doesn't do backreferences or lookaround, so anything it rejects
+    goes to re, which also raises re.error for patterns that are just bad.
+    """
+    if re2 is not None:
+        inline = b''
+        if flags & re.IGNORECASE:
+            inline += b'i'
+        if flags & re.MULTILINE:
+            inline += b'm'
+        options = re2.Options()
+        options.log_errors = False
+        options.encoding = re2.Options.Encoding.LATIN1  # Bytes, like re, not UTF-8
+        try:
+            return re2.compile(b'(?' + inline + b')' + pattern if inline else pattern, options)
+        except re2.error:
+            pass
+    return re.compile(pattern, flags)
+
+
+# Besides bytes the DFA reads a virtual start/end of line symbol around
+# each line, which is where ^ and $ get checked
+_BOL, _EOL = 256, 257
+_DFA_MAX_STATES = 1024
+_NFA_MAX_STATES = 20000
+
+_ALL_BYTES = frozenset(range(256))
+_CATEGORY_BYTES = {
+    sre_parse.CATEGORY_DIGIT: frozenset(b'0123456789'),
+    sre_parse.CATEGORY_SPACE: frozenset(b' \t\n\r\f\v'),
+    sre_parse.CATEGORY_WORD: frozenset(b'0123456789_abcdefghijklmnopqrstuvwxyz'
+                                       b'ABCDEFGHIJKLMNOPQRSTUVWXYZ'),
+}
+_CATEGORY_BYTES.update({
+    sre_parse.CATEGORY_NOT_DIGIT: _ALL_BYTES - _CATEGORY_BYTES[sre_parse.CATEGORY_DIGIT],
+    sre_parse.CATEGORY_NOT_SPACE: _ALL_BYTES - _CATEGORY_BYTES[sre_parse.CATEGORY_SPACE],
+    sre_parse.CATEGORY_NOT_WORD: _ALL_BYTES - _CATEGORY_BYTES[sre_parse.CATEGORY_WORD],
+})
+
+
+class _Unsupported(Exception):
+    """Regex feature the DFA compiler can't express."""
+
+
+@dataclass(slots=True, frozen=True)
+class _LineRegex:
+    """A regex that has to see each line on its own, since its \\A/\\Z
+    anchors would otherwise mean start/end of the whole file, and its
+    lookarounds could see the neighbouring lines."""
+    regex: object
+
+
+@dataclass(slots=True, frozen=True)
+class _Dfa:
+    """A regex compiled to a line-matching DFA, plus the regex itself for
+    finding where the match starts on lines the DFA accepts."""
+    regex: object
+    table: np.ndarray  # uint16 [states, 258], next state per byte/_BOL/_EOL
+    accept: np.ndarray  # bool [states]
+    start: int
+    dead: int  # state that can never accept, or -1
+
+
+def _compile_dfa(pattern: bytes, flags: int):
+    """Compile a bytes regex to a minimal DFA that accepts any line that
+    contains a match.
+    
+    Builds a Thompson NFA from the sre parse tree, determinizes it over byte
+    classes plus _BOL/_EOL, then minimizes by partition refinement.
+    Accepting states are absorbing since we only care whether a line
+    matches. Returns
+    (table, accept, start, dead), or None for patterns with features a DFA
+    can't express (backreferences, lookaround, \\b, ...), that only RE2
+    understands, or that blow past the state limits.
+    """
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+        if parsed.state.flags & re.LOCALE:
+            return None
+        nfa = _build_nfa(parsed, bool(parsed.state.flags & re.IGNORECASE))
+        return _determinize(*nfa)
+    except (_Unsupported, RecursionError, re.error):
+        return None
+
+
+def _build_nfa(parsed, ignorecase: bool):
+    """Thompson NFA for a parsed regex, searched anywhere in a line.
+    
+    Returns (eps, edges, start, accept). eps[kind][s] lists epsilon targets
+    of state s, where kind None is a plain epsilon and _BOL/_EOL are ones
+    only allowed at the start/end of a line. edges[s] lists (byte set,
+    target) pairs.
+    """
+    eps = {None: [], _BOL: [], _EOL: []}
+    edges = []
+    
+    def new():
+        if len(edges) >= _NFA_MAX_STATES:
+            raise _Unsupported('pattern too big')
+        for targets in eps.values():
+            targets.append([])
+        edges.append([])
+        return len(edges) - 1
+    
+    def assertion(kind):
+        a, b = new(), new()
+        eps[kind][a].append(b)
+        return a, b
+    
+    def symbol(symbols):
+        a, b = new(), new()
+        edges[a].append((frozenset(symbols), b))
+        return a, b
+    
+    def fold(chars):
+        if not ignorecase:
+            return set(chars)
+        return {*chars, *(c ^ 0x20 for c in chars if chr(c).isascii() and chr(c).isalpha())}
+    
+    def charset(items):
+        chars, negate = set(), False
+        for op, av in items:
+            if op is sre_parse.NEGATE:
+                negate = True
+            elif op is sre_parse.LITERAL:
+                chars.add(av)
+            elif op is sre_parse.RANGE:
+                chars.update(range(av[0], av[1] + 1))
+            elif op is sre_parse.CATEGORY and av in _CATEGORY_BYTES:
+                chars |= _CATEGORY_BYTES[av]
+            else:
+                raise _Unsupported(op)
+        chars = fold(chars)
+        return _ALL_BYTES - chars if negate else chars
+    
+    def seq(items):
+        a = b = new()
+        for op, av in items:
+            s, e = node(op, av)
+            eps[None][b].append(s)
+            b = e
+        return a, b
+    
+    def node(op, av):
+        if op is sre_parse.LITERAL:
+            return symbol(fold({av}))
+        if op is sre_parse.NOT_LITERAL:
+            return symbol(_ALL_BYTES - fold({av}))
+        if op is sre_parse.ANY:
+            return symbol(_ALL_BYTES)  # Newlines never reach the DFA
+        if op is sre_parse.IN:
+            return symbol(charset(av))
+        if op is sre_parse.AT and av is sre_parse.AT_BEGINNING:
+            return assertion(_BOL)
+        if op is sre_parse.AT and av is sre_parse.AT_END:
+            return assertion(_EOL)
+        if op is sre_parse.BRANCH:
+            a, b = new(), new()
+            for alt in av[1]:
+                s, e = seq(alt)
+                eps[None][a].append(s)
+                eps[None][e].append(b)
+            return a, b
+        if op is sre_parse.SUBPATTERN:
+            _, add_flags, del_flags, p = av
+            if add_flags or del_flags:
+                raise _Unsupported('scoped flags')
+            return seq(p)
+        if op is sre_parse.MAX_REPEAT or op is sre_parse.MIN_REPEAT:
+            lo, hi, p = av
+            a = b = new()
+            for _ in range(lo):
+                s, e = seq(p)
+                eps[None][b].append(s)
+                b = e
+            if hi is sre_parse.MAXREPEAT:
+                s, e = seq(p)
+                eps[None][b].append(s)
+                eps[None][e].append(b)
+            else:
+                for _ in range(hi - lo):
+                    s, e = seq(p)
+                    nxt = new()
+                    eps[None][b] += [s, nxt]
+                    eps[None][e].append(nxt)
+                    b = nxt
+            return a, b
+        raise _Unsupported(op)
+    
+    # Unanchored: loop over any prefix of the line, then the pattern
+    prefix = new()
+    edges[prefix].append((_ALL_BYTES, prefix))
+    start, accept = seq(list(parsed))
+    eps[None][prefix].append(start)
+    return eps, edges, prefix, accept
+
+
+def _determinize(eps, edges, nfa_start: int, nfa_accept: int):
+    """Subset construction plus minimization for _compile_dfa."""
+    # Group bytes that every edge treats the same way
+    sets = list({chars for out in edges for chars, _ in out})
+    classes = {}
+    class_of = np.array([classes.setdefault(tuple(b in x for x in sets), len(classes))
+                         for b in range(256)])
+    reps = [int(np.flatnonzero(class_of == c)[0]) for c in range(len(classes))]
+    
+    def closure(states, kinds):
+        seen = set(states)
+        stack = list(states)
+        while stack:
+            s = stack.pop()
+            for kind in kinds:
+                for t in eps[kind][s]:
+                    if t not in seen:
+                        seen.add(t)
+                        stack.append(t)
+        return frozenset(seen)
+    
+    # DFA states are (NFA subset, right after _BOL?). The flag matters on
+    # empty lines, where ^ can still be satisfied at _EOL.
+    initial = (closure([nfa_start], [None]), False)
+    index = {initial: 0}
+    states = [initial]
+    
+    def target(state):
+        if state not in index:
+            if len(states) >= _DFA_MAX_STATES:
+                raise _Unsupported('too many states')
+            index[state] = len(states)
+            states.append(state)
+        return index[state]
+    
+    rows = []
+    for subset, at_bol in states:
+        if nfa_accept in subset:
+            rows.append([index[subset, at_bol]] * (len(reps) + 2))  # Absorbing
+            continue
+        row = [target((closure([t for s in subset for chars, t in edges[s] if b in chars], [None]), False))
+               for b in reps]
+        row.append(target((closure(subset, [None, _BOL]), True)))
+        eol_kinds = [None, _BOL, _EOL] if at_bol else [None, _EOL]
+        row.append(target((closure(subset, eol_kinds), False)))
+        rows.append(row)
+    table = np.array(rows, dtype=np.int64)
+    accept = np.array([nfa_accept in subset for subset, _ in states])
+    
+    # Moore partition refinement: split states until every class agrees on
+    # where each symbol class goes
+    part = np.unique(accept, return_inverse=True)[1].ravel()
+    n_parts = part.max() + 1
+    while True:
+        _, refined = np.unique(np.column_stack([part, part[table]]), axis=0, return_inverse=True)
+        refined = refined.ravel()
+        n_refined = refined.max() + 1
+        if n_refined == n_parts:
+            break
+        part, n_parts = refined, n_refined
+    
+    first = np.unique(part, return_index=True)[1]
+    small = part[table[first]]
+    accept = accept[first]
+    dead = np.flatnonzero((small == np.arange(len(first))[:, None]).all(axis=1) & ~accept)
+    columns = np.append(class_of, [len(reps), len(reps) + 1])  # bytes, _BOL, _EOL
+    return (small[:, columns].astype(np.uint16), accept, int(part[0]),
+            int(dead[0]) if len(dead) else -1)
+
+
+def _walk(root: str):
+    """Yield (path, stat) for every regular file under root.
+    
+    Symlinks aren't followed, like grep -r. Unreadable directories are
+    skipped.
+    """
+    stack = [root]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            yield entry.path, entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue  # Vanished or unreadable
+        except OSError:
+            continue
+
+
+def _suffix(fpath: str) -> str:
+    """File extension the way Path.suffix reports it, without a Path."""
+    name = fpath[fpath.rfind(os.sep) + 1:]
+    dot = name.rfind('.')
+    return name[dot:] if 0 < dot < len(name) - 1 else ''
+
+
+def _count_lines_words(mm: mmap.mmap):
+    """Count lines and words in a mapped file without copying it.
+    
+    Lines are newlines + 1, like splitting on them. Words are runs of word
+    bytes, which agrees with regex word matching for ASCII text.
+    """
+    buf = np.frombuffer(mm, dtype=np.uint8)
+    lines = int(np.count_nonzero(buf == 0x0A)) + 1
+    is_word = _word_mask(buf)
+    words = int(is_word[0]) + int(np.count_nonzero(is_word[1:] & ~is_word[:-1]))
+    return lines, words
+
+
+@lru_cache(maxsize=None)
+def _unicode_word_chars() -> np.ndarray:
+    """Bool per code point, whether re counts it as \\w."""
+    table = np.zeros(0x110000, dtype=bool)
+    table[[m.start() for m in re.finditer(r'\w', ''.join(map(chr, range(0x110000))))]] = True
+    return table
+
+
+def _word_mask(buf: np.ndarray) -> np.ndarray:
+    """Bool per byte, whether it's part of a word character.
+    
+    Non-ASCII bytes count when they belong to a well-formed UTF-8 sequence
+    for a character re's \\w matches, so punctuation like curly quotes and
+    dashes splits words, and stray bytes aren't words, like decoding with
+    errors='replace'.
+    """
+    mask = _WORD_BYTES[buf]
+    high = np.flatnonzero(buf >= 0x80)
+    if not len(high):
+        return mask
+    
+    # Decode the sequence each non-ASCII byte would start, if it's a lead byte
+    def after(k):
+        at = high + k
+        return np.where(at < len(buf), buf[np.minimum(at, len(buf) - 1)], 0).astype(np.int64)
+    b0, b1, b2, b3 = buf[high].astype(np.int64), after(1), after(2), after(3)
+    c1, c2, c3 = ((b & 0xC0) == 0x80 for b in (b1, b2, b3))
+    size = np.select([(b0 >= 0xC2) & (b0 <= 0xDF) & c1,
+                      ((b0 & 0xF0) == 0xE0) & c1 & c2,
+                      (b0 >= 0xF0) & (b0 <= 0xF4) & c1 & c2 & c3], [2, 3, 4], 0)
+    code = np.select([size == 2, size == 3, size == 4],
+                     [((b0 & 0x1F) << 6) | (b1 & 0x3F),
+                      ((b0 & 0x0F) << 12) | ((b1 & 0x3F) << 6) | (b2 & 0x3F),
+                      ((b0 & 0x07) << 18) | ((b1 & 0x3F) << 12) | ((b2 & 0x3F) << 6) | (b3 & 0x3F)], 0)
+    shortest = np.array([0, 0, 0x80, 0x800, 0x10000])[size]  # Overlong forms don't decode
+    word = (size > 0) & (code >= shortest) & _unicode_word_chars()[np.minimum(code, 0x10FFFF)]
+    
+    leads, size = high[word], size[word]
+    for k in range(4):
+        mask[leads[size > k] + k] = True
+    return mask
+
+
+def _trigrams(mm: mmap.mmap) -> np.ndarray:
+    """Sorted, unique 24-bit codes of every byte trigram in a mapped file."""
+    buf = np.frombuffer(mm, dtype=np.uint8)
+    if len(buf) < 3:
+        return np.empty(0, dtype=np.uint32)
+    tri = buf[:-2].astype(np.uint32) << 16
+    tri |= buf[1:-1].astype(np.uint32) << 8
+    tri |= buf[2:]
+    tri.sort()  # sort + mask beats np.unique here by ~5x
+    return tri[np.concatenate(([True], tri[1:] != tri[:-1]))]
+
+
+# Per-thread trigram bitmap for _fused_index, one bit per 24-bit code
+_seen_trigrams = threading.local()
+
+# Stand-in for _unicode_word_chars() until a file has non-ASCII text
+_NO_CODE_POINTS = np.zeros(0, dtype=bool)
+
+
+def _index_file(mm: mmap.mmap):
+    """Lines, words and trigrams of a mapped file, as (lines, words, trigrams).
+    
+    With Numba this is one pass over the file, otherwise the numpy versions.
+    """
+    if _fused_index is None:
+        return (*_count_lines_words(mm), _trigrams(mm))
+    
+    seen = getattr(_seen_trigrams, 'bitmap', None)
+    if seen is None:
+        seen = _seen_trigrams.bitmap = np.zeros(1 << 18, dtype=np.int64)
+    buf = np.frombuffer(mm, dtype=np.uint8)
+    out = np.empty(min(max(len(buf) - 2, 0), 1 << 24), dtype=np.uint32)
+    # The code point table is only built once some file needs it
+    unicode_words = _NO_CODE_POINTS if _unicode_word_chars.cache_info().currsize == 0 else _unicode_word_chars()
+    lines, words, found = _fused_index(buf, _WORD_BYTES, unicode_words, seen, out)
+    if lines < 0:  # Hit non-ASCII text
+        lines, words, found = _fused_index(buf, _WORD_BYTES, _unicode_word_chars(), seen, out)
+    return lines, words, np.sort(out[:found])
+
+
+def _word_counts(mm: mmap.mmap, min_len: int = 3):
+    """Count the distinct words in a mapped file by hash.
+    
+    Words are runs of word characters (see _word_mask) at least min_len
+    characters long, lowercased. ASCII words are hashed without decoding;
+    the distinct words with other characters get decoded and str.lower()ed
+    once each. Returns (hashes, counts, starts, lengths) with one entry per
+    distinct word, sorted by hash; starts/lengths locate its first use.
+    """
+    buf = np.frombuffer(mm, dtype=np.uint8)
+    is_word = _word_mask(buf)
+    edges = is_word[1:] != is_word[:-1]
+    starts = np.flatnonzero(edges & is_word[1:]) + 1
+    ends = np.flatnonzero(edges & is_word[:-1]) + 1
+    if len(buf) and is_word[0]:
+        starts = np.concatenate(([0], starts))
+    if len(buf) and is_word[-1]:
+        ends = np.append(ends, len(buf))
+    lengths = ends - starts
+    
+    # Words with non-ASCII characters need Unicode lowercasing
+    high = np.flatnonzero(buf >= 0x80)
+    unicode = np.searchsorted(high, starts) < np.searchsorted(high, ends)
+    keep = unicode | (lengths >= min_len)
+    starts, lengths, unicode = starts[keep], lengths[keep], unicode[keep]
+    hashes = _hash_words(buf, starts, lengths, _LOWER)
+    if unicode.any():
+        # One decode per distinct spelling, found by hashing the raw bytes
+        raw = _hash_words(buf, starts[unicode], lengths[unicode], _SAME)
+        _, firsts, inverse = np.unique(raw, return_index=True, return_inverse=True)
+        folded = np.zeros(len(firsts), dtype=np.uint64)
+        long_enough = np.zeros(len(firsts), dtype=bool)
+        for i, at in enumerate(starts[unicode][firsts].tolist()):
+            word = mm[at:at + int(lengths[unicode][firsts[i]])].decode('utf-8', errors='replace').lower()
+            folded[i] = _fnv1a(word.encode('utf-8'))
+            long_enough[i] = len(word) >= min_len
+        hashes[unicode] = folded[inverse.ravel()]
+        keep = ~unicode
+        keep[unicode] = long_enough[inverse.ravel()]
+        starts, lengths, hashes = starts[keep], lengths[keep], hashes[keep]
+    
+    # Group by hash, keeping the earliest start of each word
+    order = np.lexsort((starts, hashes))
+    hashes = hashes[order]
+    firsts = _run_starts(hashes)
+    counts = np.diff(np.append(firsts, len(hashes)))
+    return hashes[firsts], counts, starts[order][firsts], lengths[order][firsts]
+
+
+def _hash_words(buf: np.ndarray, starts: np.ndarray, lengths: np.ndarray,
+                table: np.ndarray) -> np.ndarray:
+    """FNV-1a of each word's bytes after mapping them through table."""
+    hashes = np.empty(len(starts), dtype=np.uint64)
+    short = lengths <= _HASH_VECTOR_MAX
+    
+    # Every short word at once, one byte position at a time. Longest words
+    # go first so the words still being hashed are always a prefix. Only the
+    # gathered bytes get mapped, the file itself is never copied.
+    sstarts, slengths = starts[short], lengths[short]
+    by_len = np.argsort(-slengths, kind='stable')
+    lstarts, neg_lengths = sstarts[by_len], -slengths[by_len]
+    hashed = np.full(len(lstarts), _FNV_OFFSET, dtype=np.uint64)
+    for k in range(-int(neg_lengths[0]) if len(neg_lengths) else 0):
+        n = np.searchsorted(neg_lengths, -k)  # words longer than k
+        hashed[:n] ^= table[buf[lstarts[:n] + k]]
+        hashed[:n] *= _FNV_PRIME
+    in_order = np.empty_like(hashed)
+    in_order[by_len] = hashed
+    hashes[short] = in_order
+    
+    # Long ones (minified code, base64, lockfile hashes) one at a time, so
+    # they cost their own bytes rather than a loop step per byte
+    for i in np.flatnonzero(~short).tolist():
+        word = table[buf[starts[i]:starts[i] + lengths[i]]]
+        hashes[i] = _fnv1a(word.tobytes()) if _fnv1a_array is None else _fnv1a_array(word)
+    return hashes
+
+
+def _fnv1a(data: bytes) -> int:
+    """FNV-1a of one byte string, the same as _hash_words."""
+    h = int(_FNV_OFFSET)
+    for b in data:
+        h = ((h ^ b) * int(_FNV_PRIME)) & 0xFFFFFFFFFFFFFFFF
+    return h
+
+
+def _run_starts(values: np.ndarray) -> np.ndarray:
+    """Indexes where each run of equal values starts in a sorted array."""
+    if not len(values):
+        return np.empty(0, dtype=np.intp)
+    return np.flatnonzero(np.concatenate(([True], values[1:] != values[:-1])))
+
+
+@lru_cache(maxsize=FastGrep.RE_CACHE_SIZE)
+def _required_trigrams(needle: bytes, case_sensitive: bool) -> np.ndarray:
+    """Trigram codes any matching line has to contain.
+    
+    Literal patterns need all their own trigrams. For regexes we only look at
+    runs of plain characters at the top level of the pattern, which have to
+    appear in every match. Returns an empty array when nothing is required.
+    """
+    if not case_sensitive:
+        return np.empty(0, dtype=np.uint32)
+    
+    if _REGEX_META.intersection(needle):
+        try:
+            parsed = sre_parse.parse(needle)
+        except re.error:
+            return np.empty(0, dtype=np.uint32)
+        if parsed.state.flags & re.IGNORECASE:
+            return np.empty(0, dtype=np.uint32)
+        runs = [bytearray()]
+        for op, arg in parsed:
+            if op is sre_parse.LITERAL:
+                runs[-1].append(arg)
+            elif runs[-1]:
+                runs.append(bytearray())
+    else:
+        runs = [needle]
+    
+    codes = {(run[i] << 16) | (run[i + 1] << 8) | run[i + 2]
+             for run in runs for i in range(len(run) - 2)}
+    return np.array(sorted(codes), dtype=np.uint32)
+
+
+def _read_index_cache(cache_file: Path) -> Dict[str, tuple]:
+    """Load a saved codebase index as {file: (mtime, size, lines, words, trigrams)}."""
+    try:
+        with np.load(cache_file) as data:
+            files = data['files'].tolist()
+            mtimes = data['mtimes'].tolist()
+            sizes = data['sizes'].tolist()
+            lines = data['lines'].tolist()
+            words = data['words'].tolist()
+            bounds = data['offsets']
+            trigrams = data['trigrams']
+    except (OSError, KeyError, ValueError, EOFError, zipfile.BadZipFile):
+        return {}  # No cache yet, or it's unreadable
+    return {
+        fpath: (mtime, size, n_lines, n_words, trigrams[bounds[i]:bounds[i + 1]])
+        for i, (fpath, mtime, size, n_lines, n_words)
+        in enumerate(zip(files, mtimes, sizes, lines, words))
+    }
+
+
+def _write_index_cache(cache_file: Path, cb: Codebase, trigrams: np.ndarray, offsets: np.ndarray):
+    """Save per-file counts and trigrams so the next load can skip them.
+    
+    trigrams are every file's codes end to end, row i's from offsets[i]
+    to offsets[i + 1].
+    """
+    tmp = None
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        # A temp file of our own, so concurrent loads of the same tree
+        # never replace the cache with a file another one is still writing
+        with tempfile.NamedTemporaryFile(dir=cache_file.parent, suffix='.tmp', delete=False) as out:
+            tmp = out.name
+            np.savez(out,
+                     files=np.array(cb.paths),
+                     mtimes=cb.mtimes,
+                     sizes=cb.sizes,
+                     lines=cb.lines,
+                     words=cb.words,
+                     offsets=offsets,
+                     trigrams=trigrams)
+        os.replace(tmp, cache_file)
+    except OSError as e:
+        print(f"Couldn't save index: {e}")
+        if tmp is not None:
             try:
-                request = self.queue.get(timeout=1)
-                results = self.search(request)
-                print(f"\nSearch done: '{request.pattern}' in '{request.codebase}'")
-                print(f"Found {len(results)} matches")
-                self.queue.task_done()
-            except:
-                continue  # Timeout or empty queue
+                os.unlink(tmp)
+            except OSError:
+                pass
+
+
+def _newline_index(mm: mmap.mmap) -> np.ndarray:
+    """Offsets of every newline in a mapped file."""
+    buf = np.frombuffer(mm, dtype=np.uint8)
+    return np.flatnonzero(buf == 0x0A)
+
+
+def _scan(mm: mmap.mmap, matcher):
+    """Yield (line_start, line_end, match_offset) for each matching line.
+    
+    matcher is either a bytes literal, a compiled bytes regex or a
+    _LineRegex. The whole buffer is scanned at once and we jump to the next
+    line after each hit, so a line is reported at most once, like grep.
+    """
+    if isinstance(matcher, _LineRegex):
+        yield from _scan_lines(mm, matcher.regex)
+        return
+    if isinstance(matcher, bytes) and b'\n' in matcher:
+        return  # Lines never contain a newline
+    
+    size = len(mm)
+    start = 0
+    while start <= size:
+        if isinstance(matcher, bytes):
+            off = mm.find(matcher, start)
+            if off == -1:
+                return
+        else:
+            match = matcher.search(mm, start)
+            if match is None:
+                return
+            off = match.start()
+        
+        ls = mm.rfind(b'\n', 0, off) + 1
+        le = mm.find(b'\n', off)
+        if le == -1:
+            le = size
+        
+        # A regex match can run across a newline, so recheck within the line
+        if not isinstance(matcher, bytes) and match.end() > le:
+            match = matcher.search(mm, ls, le)
+            if match is None:
+                start = le + 1
+                continue
+            off = match.start()
+        
+        yield ls, le, off
+        start = le + 1
+
+
+def _scan_lines(mm: mmap.mmap, regex):
+    """_scan, but running the regex on a copy of each line by itself."""
+    size = len(mm)
+    start = 0
+    while start <= size:
+        le = mm.find(b'\n', start)
+        if le == -1:
+            le = size
+        match = regex.search(mm[start:le])
+        if match is not None:
+            yield start, le, start + match.start()
+        start = le + 1
+
+
+if njit is not None:
+    @njit(nogil=True, boundscheck=False, cache=True)
+    def _scan_literal(buf, needle, start, out):
+        """Numba twin of _scan for literals without newlines.
+        
+        Fills out with (line_start, line_end, offset) rows from start on and
+        returns (rows filled, where to resume). Stops early when out is full.
+        """
+        n = len(buf)
+        m = len(needle)
+        first = needle[0]
+        count = 0
+        ls = start
+        i = start
+        while i <= n - m:
+            b = buf[i]
+            if b == 0x0A:
+                ls = i + 1
+            elif b == first:
+                j = 1
+                while j < m and buf[i + j] == needle[j]:
+                    j += 1
+                if j == m:
+                    le = i + m
+                    while le < n and buf[le] != 0x0A:
+                        le += 1
+                    out[count, 0] = ls
+                    out[count, 1] = le
+                    out[count, 2] = i
+                    count += 1
+                    i = le + 1
+                    ls = i
+                    if count == len(out):
+                        return count, i
+                    continue
+            i += 1
+        return count, n + 1
+    
+    @njit(nogil=True, boundscheck=False, cache=True)
+    def _scan_dfa(buf, table, accept, state0, dead, start, out):
+        """Run a _Dfa over each line from start on.
+        
+        Fills out with (line_start, line_end) rows for accepted lines and
+        returns (rows filled, where to resume), like _scan_literal.
+        """
+        n = len(buf)
+        count = 0
+        i = start
+        while i <= n:
+            ls = i
+            state = table[state0, 256]
+            while not accept[state] and i < n and buf[i] != 0x0A:
+                if state == dead:
+                    break
+                state = table[state, buf[i]]
+                i += 1
+            while i < n and buf[i] != 0x0A:
+                i += 1
+            if not accept[state] and state != dead:
+                state = table[state, 257]
+            if accept[state]:
+                out[count, 0] = ls
+                out[count, 1] = i
+                count += 1
+                if count == len(out):
+                    return count, i + 1
+            i += 1
+        return count, n + 1
+    
+    @njit(nogil=True, boundscheck=False, cache=True)
+    def _fused_index(buf, word_bytes, unicode_words, seen, out):
+        """_count_lines_words and _trigrams in a single pass over buf.
+        
+        Each trigram code seen for the first time is flagged in the seen
+        bitmap and written to out, unsorted. The flags are cleared again
+        before returning so seen can be reused. Returns
+        (lines, words, codes written), or lines of -1 if the file has
+        non-ASCII text but unicode_words is empty.
+        """
+        n = len(buf)
+        lines = 1
+        words = 0
+        in_word = False
+        word_until = 0  # end of the current multi-byte word character
+        code = 0
+        found = 0
+        for i in range(n):
+            b = buf[i]
+            if b == 0x0A:
+                lines += 1
+            if b < 0x80:
+                is_word = word_bytes[b]
+            elif i < word_until:
+                is_word = True
+            else:
+                # Same decoding as _word_mask
+                is_word = False
+                size = 0
+                point = 0
+                if 0xC2 <= b <= 0xDF:
+                    size, point = 2, b & 0x1F
+                elif b & 0xF0 == 0xE0:
+                    size, point = 3, b & 0x0F
+                elif 0xF0 <= b <= 0xF4:
+                    size, point = 4, b & 0x07
+                if size and i + size <= n:
+                    for k in range(1, size):
+                        c = buf[i + k]
+                        if c & 0xC0 != 0x80:
+                            size = 0
+                            break
+                        point = (point << 6) | (c & 0x3F)
+                    if size:
+                        if len(unicode_words) == 0:
+                            for j in range(found):
+                                seen[out[j] >> 6] = 0
+                            return -1, 0, 0
+                        shortest = 0x80 if size == 2 else 0x800 if size == 3 else 0x10000
+                        if shortest <= point <= 0x10FFFF and unicode_words[point]:
+                            is_word = True
+                            word_until = i + size
+            if is_word and not in_word:
+                words += 1
+            in_word = is_word
+            code = ((code << 8) | b) & 0xFFFFFF
+            if i >= 2:
+                bit = 1 << (code & 63)
+                if not seen[code >> 6] & bit:
+                    seen[code >> 6] |= bit
+                    out[found] = code
+                    found += 1
+        for j in range(found):
+            seen[out[j] >> 6] = 0
+        return lines, words, found
+    
+    @njit(nogil=True, boundscheck=False, cache=True)
+    def _fnv1a_array(data):
+        """_fnv1a of a uint8 array."""
+        h = _FNV_OFFSET
+        for b in data:
+            h = (h ^ np.uint64(b)) * _FNV_PRIME
+        return h
+else:
+    _scan_literal = None
+    _scan_dfa = None
+    _fused_index = None
+    _fnv1a_array = None
+
+
+# Longest literal that gets its own generated scanner
+_SPECIALIZE_MAX = 64
+
+# Scanner for one literal, with the needle's bytes baked in as constants.
+# Behaves like _scan_literal, but the hot loop is only the byte compares:
+# the line start is found by walking back from a hit instead of tracking
+# every newline on the way.
+_SPECIALIZED_TEMPLATE = """
+@njit(nogil=True, boundscheck=False)
+def scan(buf, start, out):
+    n = len(buf)
+    count = 0
+    i = start
+    while i <= n - {m}:
+        if {cond}:
+            ls = i
+            while ls > start and buf[ls - 1] != 0x0A:
+                ls -= 1
+            le = i + {m}
+            while le < n and buf[le] != 0x0A:
+                le += 1
+            out[count, 0] = ls
+            out[count, 1] = le
+            out[count, 2] = i
+            count += 1
+            i = le + 1
+            if count == len(out):
+                return count, i
+            continue
+        i += 1
+    return count, n + 1
+"""
+
+
+@lru_cache(maxsize=FastGrep.RE_CACHE_SIZE)
+def _literal_scanner(needle: bytes):
+    """Jit a scanner specialized to needle, or fall back to _scan_literal."""
+    if len(needle) > _SPECIALIZE_MAX:
+        return partial(_scan_literal, needle=np.frombuffer(needle, dtype=np.uint8))
+    
+    # Unrolled compares, in order for short needles. Longer ones check the
+    # first and last byte before the middle, which rejects most positions early.
+    order = list(range(len(needle)))
+    if len(needle) > 8:
+        order = [0, len(needle) - 1] + order[1:-1]
+    cond = ' and '.join(f'buf[i + {k}] == {needle[k]}' for k in order)
+    
+    namespace = {}
+    exec(_SPECIALIZED_TEMPLATE.format(m=len(needle), cond=cond), {'njit': njit}, namespace)
+    return namespace['scan']
+
+
+def _nogil(matcher) -> bool:
+    """Whether a matcher runs in one of the GIL-free Numba scanners."""
+    if isinstance(matcher, _Dfa):
+        return True
+    return (_scan_literal is not None and isinstance(matcher, bytes)
+            and matcher != b'' and b'\n' not in matcher)
+
+
+def _collect(mm: mmap.mmap, matcher, limit: Optional[int] = None, scanner=None) -> array:
+    """Run _scan over one file, packing hits as flat (ls, le, off) triples.
+    
+    scanner can be a _literal_scanner() for a literal matcher, otherwise
+    literals go through the generic _scan_literal.
+    """
+    if isinstance(matcher, _Dfa):
+        return _collect_dfa(mm, matcher, limit)
+    if _nogil(matcher):
+        return _collect_literal(mm, matcher, limit, scanner)
+    
+    hits = array('q')
+    for hit in _scan(mm, matcher):
+        hits.extend(hit)
+        if limit and len(hits) >= 3 * limit:
+            break
+    return hits
+
+
+def _collect_literal(mm: mmap.mmap, needle: bytes, limit: Optional[int], scan=None) -> array:
+    """_collect for literals, run through a Numba scanner a block at a time."""
+    buf = np.frombuffer(mm, dtype=np.uint8)
+    if scan is None:
+        scan = partial(_scan_literal, needle=np.frombuffer(needle, dtype=np.uint8))
+    out = np.empty((min(limit, 4096) if limit else 4096, 3), dtype=np.int64)
+    hits = array('q')
+    start = 0
+    while True:
+        found, start = scan(buf, start=start, out=out)
+        hits.frombytes(out[:found].tobytes())
+        if found < len(out) or (limit and len(hits) >= 3 * limit):
+            return hits
+
+
+def _collect_dfa(mm: mmap.mmap, dfa: _Dfa, limit: Optional[int]) -> array:
+    """_collect for DFAs. Numba finds the matching lines, then the regex
+    runs on just those lines to find where each match starts."""
+    buf = np.frombuffer(mm, dtype=np.uint8)
+    out = np.empty((min(limit, 4096) if limit else 4096, 2), dtype=np.int64)
+    hits = array('q')
+    start = 0
+    while True:
+        found, start = _scan_dfa(buf, dfa.table, dfa.accept, dfa.start, dfa.dead, start, out)
+        for ls, le in out[:found].tolist():
+            match = dfa.regex.search(mm, ls, le)
+            if match is not None:
+                hits.extend((ls, le, match.start()))
+        if found < len(out) or (limit and len(hits) >= 3 * limit):
+            return hits
+
+
+# Each search process keeps its own matcher cache
+_worker_matcher = lru_cache(maxsize=FastGrep.RE_CACHE_SIZE)(_make_matcher)
+
+
+def _search_files(files: List[tuple], needle: bytes, case_sensitive: bool,
+                  limit: Optional[int]) -> List[Optional[array]]:
+    """Process pool task: scan (path, size, mtime) files, returning packed hits
+    for each. Files that are gone or changed since they were loaded get None,
+    since their offsets wouldn't line up with the loaded mmap."""
+    matcher = _worker_matcher(needle, case_sensitive)
+    out = []
+    for path, size, mtime in files:
+        try:
+            with open(path, 'rb') as file:
+                stat_info = os.fstat(file.fileno())
+                if (stat_info.st_size, stat_info.st_mtime) != (size, mtime):
+                    out.append(None)
+                    continue
+                mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except OSError:
+            out.append(None)
+            continue
+        try:
+            out.append(_collect(mm, matcher, limit))
+        finally:
+            mm.close()
+    return out
 
 
 def shell_grep(path: str, pattern: str, case_sensitive: bool = True) -> List[SearchResult]:
@@ -329,18 +1614,18 @@ def shell_grep(path: str, pattern: str, case_sensitive: bool = True) -> List[Sea
     cmd.extend([pattern, path])
     
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
-        results = []
+        result = subprocess.run(cmd, capture_output=True, timeout=30)
         
-        for line in result.stdout.strip().split('\n'):
+        results = []
+        for line in result.stdout.split(b'\n'):
             if not line:
                 continue
-            parts = line.split(':', 2)
+            parts = line.split(b':', 2)
             if len(parts) >= 3:
                 results.append(SearchResult(
-                    file=parts[0],
+                    file=os.fsdecode(parts[0]),
                     line=int(parts[1]),
-                    text=parts[2].strip(),
+                    raw=parts[2],
                     pos=0
                 ))
         
@@ -378,21 +1663,28 @@ def benchmark(path: str, patterns: List[str], runs: int = 3):
     print("-" * 70)
     
     all_good = True
+    verify_time = 0.0  # The shell pass here doubles as timing run 1
     for pattern in patterns:
         print(f"\nChecking: '{pattern}'")
         
+        start = time.time()
         shell_results = shell_grep(path, pattern)
-        shell_count = len(shell_results)
+        verify_time += time.time() - start
+        shell_hits = frozenset((os.path.normpath(r.file), r.line) for r in shell_results)
         
         request = SearchRequest(codebase='bench', pattern=pattern)
         mmap_results = grep.search(request)
-        mmap_count = len(mmap_results)
+        mmap_hits = frozenset((os.path.normpath(r.file), r.line) for r in mmap_results)
         
-        print(f"  Shell:  {shell_count} matches")
-        print(f"  Mmap:   {mmap_count} matches")
+        print(f"  Shell:  {len(shell_hits)} matches")
+        print(f"  Mmap:   {len(mmap_hits)} matches")
         
-        if shell_count != mmap_count:
-            print(f"  ⚠️  MISMATCH!")
+        diffs = shell_hits ^ mmap_hits
+        if diffs:
+            print(f"  ⚠️  MISMATCH! {len(diffs)} lines differ")
+            for fpath, line in sorted(diffs)[:5]:
+                side = 'shell only' if (fpath, line) in shell_hits else 'mmap only'
+                print(f"    {fpath}:{line} ({side})")
             all_good = False
         else:
             print(f"  ✅ Match!")
@@ -400,13 +1692,20 @@ def benchmark(path: str, patterns: List[str], runs: int = 3):
     print(f"\nOverall: {'✅ PASSED' if all_good else '⚠️  ISSUES'}")
     print()
     
+    # Compile everything up front so the timings only measure matching. A
+    # literal's scanner is generated on its second search, so run each
+    # pattern once more untimed rather than just building its matcher.
+    for pattern in patterns:
+        grep.search(SearchRequest(codebase='bench', pattern=pattern))
+    
     # Benchmark shell grep
     print("-" * 70)
     print("SHELL GREP")
     print("-" * 70)
-    shell_times = []
+    shell_times = [verify_time]
+    print(f"Run 1: {verify_time:.3f}s")
     
-    for run in range(runs):
+    for run in range(1, runs):
         start = time.time()
         for pattern in patterns:
             shell_grep(path, pattern)
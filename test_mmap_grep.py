@@ -0,0 +1,403 @@
+"""Tests for mmap_grep."""
+
+import mmap
+import os
+import random
+import re
+import threading
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+import mmap_grep
+
+
+needs_numba = pytest.mark.skipif(mmap_grep.njit is None, reason="needs numba")
+
+
+def _random_pattern(rng: random.Random, depth: int = 0) -> str:
+    """A random regex built from the features _build_nfa supports."""
+    atoms = ['a', 'b', 'c', '.', '[ab]', '[^a]', '\\d', '\\s', '\\w', '\\W',
+             '[a-c]', '(a|bc)', '(?:ab)*', 'x', '^', '$', 'A', '[A-Z]']
+    quants = ['', '', '', '*', '+', '?', '{2}', '{1,3}', '*?']
+    parts = []
+    for _ in range(rng.randint(1, 4)):
+        if depth > 1 or rng.random() < 0.7:
+            atom = rng.choice(atoms)
+        else:
+            atom = '(' + _random_pattern(rng, depth + 1) + ')'
+        parts.append(atom + ('' if atom in ('^', '$') else rng.choice(quants)))
+    pattern = ''.join(parts)
+    if rng.random() < 0.2:
+        pattern += '|' + _random_pattern(rng, depth + 1)
+    return pattern
+
+
+@needs_numba
+def test_dfa_matches_re_on_random_patterns():
+    rng = random.Random(7)
+    lines = [''.join(rng.choice('abcxA1 _-\t') for _ in range(rng.randint(0, 12))).encode()
+             for _ in range(300)]
+    buf = b'\n'.join(lines)
+    out = np.empty((len(lines), 2), dtype=np.int64)
+
+    tested = 0
+    for _ in range(500):
+        pattern = _random_pattern(rng).encode()
+        flags = re.MULTILINE | (re.IGNORECASE if rng.random() < 0.3 else 0)
+        try:
+            regex = re.compile(pattern, flags)
+        except re.error:
+            continue
+        dfa = mmap_grep._compile_dfa(pattern, flags)
+        if dfa is None:
+            continue
+        tested += 1
+
+        found, _ = mmap_grep._scan_dfa(np.frombuffer(buf, dtype=np.uint8), *dfa, 0, out)
+        got = [buf[ls:le] for ls, le in out[:found].tolist()]
+        assert got == [line for line in lines if regex.search(line)], (pattern, flags)
+    assert tested > 300
+
+
+def test_compile_dfa_gives_up_on_patterns_re_cannot_parse():
+    assert mmap_grep._compile_dfa(rb'\pLu', re.MULTILINE) is None
+    assert mmap_grep._compile_dfa(rb'\Q a.b\E', re.MULTILINE) is None
+
+
+def _load(tmp_path, monkeypatch, text: bytes) -> mmap_grep.FastGrep:
+    monkeypatch.setattr(mmap_grep.FastGrep, 'CACHE_DIR', tmp_path / 'cache')
+    (tmp_path / 'a.txt').write_bytes(text)
+    grep = mmap_grep.FastGrep()
+    assert grep.load('t', str(tmp_path))
+    return grep
+
+
+def test_literal_with_newline_matches_nothing(tmp_path, monkeypatch):
+    grep = _load(tmp_path, monkeypatch, b'xa\nby\n')
+    assert grep.search(mmap_grep.SearchRequest(codebase='t', pattern='a\nb')) == []
+
+
+def test_string_anchors_apply_per_line(tmp_path, monkeypatch):
+    grep = _load(tmp_path, monkeypatch, b'xa\nby\nX1\nx2\n')
+    request = mmap_grep.SearchRequest(codebase='t', pattern=r'\Ax', case_sensitive=False)
+    assert [r.line for r in grep.search(request)] == [1, 3, 4]
+    request = mmap_grep.SearchRequest(codebase='t', pattern=r'y\Z')
+    assert [r.line for r in grep.search(request)] == [2]
+
+
+@pytest.mark.parametrize('pattern', [r'(?<=\s)a', r'(?<!x)a', r'a(?=\s)', r'(a|(?<=b)c)(?!b)'])
+def test_lookarounds_apply_per_line(tmp_path, monkeypatch, pattern):
+    text = b'xa\nab a\n b\nbc\n'
+    grep = _load(tmp_path, monkeypatch, text)
+    request = mmap_grep.SearchRequest(codebase='t', pattern=pattern)
+    expected = [(i + 1, m.start()) for i, line in enumerate(text.split(b'\n'))
+                for m in [re.search(pattern.encode(), line)] if m]
+    assert [(r.line, r.pos) for r in grep.search(request)] == expected
+
+
+def test_unicode_punctuation_splits_words(tmp_path, monkeypatch):
+    text = '“hello” — said “hello” to “hello”, café\n'.encode()
+    grep = _load(tmp_path, monkeypatch, text)
+    assert grep.stats('t').words == len(re.findall(r'\w+', text.decode()))
+
+
+def test_common_words_lowercase_and_measure_characters(tmp_path, monkeypatch):
+    text = 'Café café CAFÉ né né Straße STRASSE\n'.encode()
+    grep = _load(tmp_path, monkeypatch, text)
+    assert dict(grep.stats('t').common_words) == {'café': 3, 'straße': 1, 'strasse': 1}
+
+
+def test_stats_totals_by_extension_and_biggest_files(tmp_path, monkeypatch):
+    # Each file is n lines of "x", so 2n bytes, n + 1 lines and n words
+    sizes = {'b.py': 55, 'c.md': 50, 'd.txt': 45, 'e.py': 40, 'f.md': 35, 'g.txt': 30,
+             'h.py': 25, 'i.md': 20, 'j.txt': 20, 'k.py': 20, 'l.md': 5}
+    for name, n in sizes.items():
+        (tmp_path / name).write_bytes(b'x\n' * n)
+    grep = _load(tmp_path, monkeypatch, b'x\n' * 60)
+    stats = grep.stats('t')
+    assert (stats.files, stats.size, stats.lines, stats.words) == (12, 810, 417, 405)
+    assert stats.types == {'.txt': 4, '.py': 4, '.md': 4}
+    assert stats.size_by_ext == {'.txt': 310, '.py': 280, '.md': 220}
+    assert stats.lines_by_ext == {'.txt': 159, '.py': 144, '.md': 114}
+
+    # Three files tie for 10th place, the first two loaded make the cut
+    tied = [os.path.basename(f) for f in grep.codebases['t'].paths
+            if os.path.basename(f) in ('i.md', 'j.txt', 'k.py')]
+    assert [os.path.basename(f.file) for f in stats.biggest] == [
+        'a.txt', 'b.py', 'c.md', 'd.txt', 'e.py', 'f.md', 'g.txt', 'h.py', *tied[:2]]
+
+    path = str(tmp_path / 'e.py')
+    assert grep.file_info('t', path) == mmap_grep.FileInfo(
+        file=path, size=80, ext='.py', mtime=os.stat(path).st_mtime, lines=41, words=40)
+    assert grep.file_info('t', str(tmp_path / 'missing.py')) is None
+
+
+@pytest.mark.parametrize('damage', [b'', b'garbage', None])
+def test_corrupt_index_cache_is_rebuilt(tmp_path, monkeypatch, damage):
+    grep = _load(tmp_path, monkeypatch, b'one two\nthree\n')
+    cache_file, = (tmp_path / 'cache').glob('*.index.npz')
+    good = cache_file.read_bytes()
+    cache_file.write_bytes(good[:len(good) // 2] if damage is None else damage)
+
+    assert grep.load('t', str(tmp_path))
+    assert (grep.stats('t').lines, grep.stats('t').words) == (3, 3)
+    assert mmap_grep._read_index_cache(cache_file)  # Rewritten, readable again
+
+
+def test_hash_words_matches_fnv1a_past_the_vector_cap():
+    words = [b'ab', b'Cd' * 40, b'x' * 300, b'EfG']
+    text = b' '.join(words)
+    buf = np.frombuffer(text, dtype=np.uint8)
+    starts = np.array([text.index(w) for w in words])
+    lengths = np.array([len(w) for w in words])
+    hashes = mmap_grep._hash_words(buf, starts, lengths, mmap_grep._LOWER)
+    assert hashes.tolist() == [mmap_grep._fnv1a(w.lower()) for w in words]
+
+
+@needs_numba
+def test_literal_scanner_generated_only_once_it_pays():
+    grep = mmap_grep.FastGrep()
+    assert grep._scanner(b'needle', 0) is None
+    assert grep._scanner(b'needle', 0) is mmap_grep._literal_scanner(b'needle')
+    assert grep._scanner(b'other', grep.SPECIALIZE_MIN_BYTES) is mmap_grep._literal_scanner(b'other')
+
+
+def _scanned_files(monkeypatch, grep: mmap_grep.FastGrep, name: str) -> list:
+    """Record the files search() scans in codebase name."""
+    files = {id(mm): fpath for fpath, mm in grep.codebases[name].files.items()}
+    scanned = []
+    collect = mmap_grep._collect
+    def spy(mm, *args, **kwargs):
+        scanned.append(files[id(mm)])
+        return collect(mm, *args, **kwargs)
+    monkeypatch.setattr(mmap_grep, '_collect', spy)
+    return scanned
+
+
+def test_trigrams_skip_files_that_cannot_match(tmp_path, monkeypatch):
+    (tmp_path / 'b.txt').write_bytes(b'nothing to see\n')
+    grep = _load(tmp_path, monkeypatch, b'x = 1\ny = foo_bar(2)\n')
+    scanned = _scanned_files(monkeypatch, grep, 't')
+    for pattern in ['foo_bar', r'foo_(bar|baz)\(\d\)', r'y = \w+']:
+        scanned.clear()
+        results = grep.search(mmap_grep.SearchRequest(codebase='t', pattern=pattern))
+        assert [(os.path.basename(r.file), r.line) for r in results] == [('a.txt', 2)]
+        assert [os.path.basename(f) for f in scanned] == ['a.txt']
+
+
+def test_trigram_index_finds_files_with_every_required_trigram(tmp_path, monkeypatch):
+    rng = random.Random(0)
+    for i in range(30):
+        (tmp_path / f'f{i}.txt').write_bytes(bytes(rng.choice(b'abcd') for _ in range(rng.randrange(1, 40))))
+    grep = _load(tmp_path, monkeypatch, b'abcdabcd')
+    cb = grep.codebases['t']
+    per_file = [set(mmap_grep._trigrams(cb.files[fpath]).tolist()) for fpath in cb.paths]
+    for _ in range(200):
+        required = np.unique([rng.choice(sorted(set().union(*per_file)))
+                              for _ in range(rng.randrange(1, 4))]).astype(np.uint32)
+        expected = [row for row, codes in enumerate(per_file) if codes.issuperset(required.tolist())]
+        assert cb.rows_with(required).tolist() == expected
+    assert cb.rows_with(np.array([0x7A7A7A], dtype=np.uint32)).tolist() == []
+
+
+def test_index_cache_reused_until_a_file_changes(tmp_path, monkeypatch):
+    _load(tmp_path, monkeypatch, b'alpha beta\n')
+    indexed = []
+    index_file = mmap_grep._index_file
+    monkeypatch.setattr(mmap_grep, '_index_file', lambda mm: indexed.append(mm) or index_file(mm))
+
+    grep = mmap_grep.FastGrep()
+    assert grep.load('t', str(tmp_path))
+    assert indexed == []
+
+    # Same size, so only the mtime tells the cached entry is stale
+    path = tmp_path / 'a.txt'
+    mtime = path.stat().st_mtime
+    path.write_bytes(b'gamma\nbeta\n')
+    os.utime(path, (mtime + 10, mtime + 10))
+    grep = mmap_grep.FastGrep()
+    assert grep.load('t', str(tmp_path))
+    assert len(indexed) == 1
+    assert (grep.stats('t').lines, grep.stats('t').words) == (3, 2)
+    found = grep.search(mmap_grep.SearchRequest(codebase='t', pattern='gamma'))
+    assert [r.line for r in found] == [1]
+
+    path.write_bytes(b'delta\n')
+    grep = mmap_grep.FastGrep()
+    assert grep.load('t', str(tmp_path))
+    assert len(indexed) == 2
+    assert grep.search(mmap_grep.SearchRequest(codebase='t', pattern='delta'))
+    assert not grep.search(mmap_grep.SearchRequest(codebase='t', pattern='gamma'))
+
+
+def _pooled(grep: mmap_grep.FastGrep) -> mmap_grep.FastGrep:
+    """Send every search of grep through the process pool, a file per task."""
+    grep.workers = 2
+    grep.PARALLEL_MIN_BYTES = 0
+    grep.BATCH_BYTES = 1
+    return grep
+
+
+def _hits(results) -> list:
+    return [(os.path.basename(r.file), r.line, r.pos, r.raw) for r in results]
+
+
+def test_process_pool_matches_in_process_scan(tmp_path, monkeypatch):
+    for i in range(4):
+        (tmp_path / f'f{i}.txt').write_bytes(b'foo bar\nfoobar %d\n' % i + b'x foo\n' * i)
+    grep = _load(tmp_path, monkeypatch, b'no match\n')
+    grep.workers = 1
+    pooled = _pooled(mmap_grep.FastGrep())
+    assert pooled.load('t', str(tmp_path))
+    try:
+        for pattern in [r'\bfoo\b', r'(o)\1b']:
+            request = mmap_grep.SearchRequest(codebase='t', pattern=pattern)
+            expected = _hits(grep.search(request))
+            assert expected
+            assert _hits(pooled.search(request)) == expected
+            assert pooled.pool is not None
+    finally:
+        pooled.unload('t')
+
+
+def test_process_pool_falls_back_for_files_changed_since_load(tmp_path, monkeypatch):
+    (tmp_path / 'b.txt').write_bytes(b'b foo\n')
+    grep = _pooled(_load(tmp_path, monkeypatch, b'a foo\nfoo a\n'))
+    path = tmp_path / 'a.txt'
+    stat_info = path.stat()
+    assert mmap_grep._search_files([(str(path), stat_info.st_size, stat_info.st_mtime + 1),
+                                    (str(tmp_path / 'gone.txt'), 1, 0.0)],
+                                   rb'\bfoo\b', True, None) == [None, None]
+
+    # Replace the file rather than rewrite it, so the loaded mmap keeps the old bytes
+    request = mmap_grep.SearchRequest(codebase='t', pattern=r'\bfoo\b')
+    before = _hits(grep.search(request))
+    (tmp_path / 'new.tmp').write_bytes(b'nothing\n')
+    os.replace(tmp_path / 'new.tmp', path)
+    try:
+        assert _hits(grep.search(request)) == before
+    finally:
+        grep.unload('t')
+
+
+@needs_numba
+@pytest.mark.parametrize('text', [
+    b'ab',
+    b'def foo_bar(x):\n    return x + 1\n\n',
+    'naïve café — “quoted” 日本語 x\nÉTÉ été\n'.encode(),
+    b'\xff\xfeab \xc3 \xe2\x80 ok\xed\xa0\x80 \xc0\xaf caf\xc3\xa9\xc3',
+])
+def test_fused_index_matches_numpy_versions(tmp_path, text):
+    path = tmp_path / 'a.txt'
+    path.write_bytes(text)
+    with open(path, 'rb') as file:
+        mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        lines, words, trigrams = mmap_grep._index_file(mm)
+        assert (lines, words) == mmap_grep._count_lines_words(mm)
+        assert np.array_equal(trigrams, mmap_grep._trigrams(mm))
+    finally:
+        mm.close()
+
+
+@needs_numba
+@pytest.mark.parametrize('length', [1, 9, 64, 65])
+def test_literal_scanners_match_scan(tmp_path, length):
+    rng = random.Random(length)
+    needle = bytes(rng.choice(b'ab') for _ in range(length))
+    # Near misses, several hits a line, more hits than one output block, and one at the end
+    lines = [needle[:-1] + b'a' + needle[1:], needle + b'b' + needle]
+    lines += [bytes(rng.choice(b'ab') for _ in range(rng.randrange(2 * length))) + needle for _ in range(5000)]
+    path = tmp_path / 'a.txt'
+    path.write_bytes(b'\n'.join(lines) + b'\n' + needle)
+    with open(path, 'rb') as file:
+        mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        expected = [offset for hit in mmap_grep._scan(mm, needle) for offset in hit]
+        for scanner in [None, mmap_grep._literal_scanner(needle)]:
+            assert mmap_grep._collect(mm, needle, scanner=scanner).tolist() == expected
+            for limit in [1, 7, 4097]:
+                hits = mmap_grep._collect(mm, needle, limit, scanner).tolist()
+                assert len(hits) >= 3 * limit and hits == expected[:len(hits)]
+    finally:
+        mm.close()
+
+
+def test_stats_recount_only_changed_files(tmp_path, monkeypatch):
+    (tmp_path / 'b.txt').write_bytes(b'beta beta\n')
+    grep = _load(tmp_path, monkeypatch, b'alpha alpha alpha\n')
+    counted = []
+    word_counts = mmap_grep._word_counts
+    monkeypatch.setattr(mmap_grep, '_word_counts', lambda mm: counted.append(mm[:]) or word_counts(mm))
+
+    stats = grep.stats('t')
+    assert sorted(counted) == [b'alpha alpha alpha\n', b'beta beta\n']
+    assert grep.stats('t') is stats
+    assert len(counted) == 2
+
+    counted.clear()
+    (tmp_path / 'b.txt').write_bytes(b'gamma gamma gamma gamma\n')
+    assert grep.load('t', str(tmp_path))
+    assert len(grep._word_cache) == 1
+    stats = grep.stats('t')
+    assert counted == [b'gamma gamma gamma gamma\n']
+    assert stats.common_words == [('gamma', 4), ('alpha', 3)]
+    assert grep.stats('t') is stats
+
+
+def test_worker_reports_every_queued_search(tmp_path, monkeypatch, capsys):
+    grep = _load(tmp_path, monkeypatch, b'foo\n')
+    n = grep.BATCH_SIZE + 5
+    # The first batch only gets past the barrier if it all runs at once
+    barrier = threading.Barrier(grep.BATCH_SIZE)
+    search = grep.search
+    def fake_search(request):
+        index = int(request.pattern[1:])
+        if index < grep.BATCH_SIZE:
+            barrier.wait(timeout=10)
+        if index == grep.BATCH_SIZE + 2:
+            raise ValueError('boom')
+        return search(mmap_grep.SearchRequest(codebase='t', pattern='foo'))
+    monkeypatch.setattr(grep, 'search', fake_search)
+
+    for i in range(n):
+        grep.add_search(mmap_grep.SearchRequest(codebase='t', pattern=f'p{i}'))
+    grep.start_worker()
+    joined = threading.Thread(target=grep.queue.join, daemon=True)
+    joined.start()
+    joined.join(timeout=30)
+    grep.stop_worker()
+    assert not joined.is_alive()
+
+    out = capsys.readouterr().out
+    done = re.findall(r"Search done: 'p(\d+)'", out)
+    assert sorted(map(int, done)) == [i for i in range(n) if i != grep.BATCH_SIZE + 2]
+    assert f"Search failed: 'p{grep.BATCH_SIZE + 2}' in 't': boom" in out
+
+
+@pytest.mark.parametrize('name', ['x.tar.gz', '.bashrc', 'a.b.', 'a..b', 'noext', '.', '..', '...',
+                                  os.path.join('dir.d', 'file'), os.path.join('a', 'b.c', '.hidden.txt')])
+def test_suffix_matches_path_suffix(name):
+    assert mmap_grep._suffix(name) == Path(name).suffix
+
+
+def test_load_skips_symlinks_and_unreadable_directories(tmp_path, monkeypatch):
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'sub' / 'b.txt').write_bytes(b'b\n')
+    (tmp_path / 'locked').mkdir()
+    (tmp_path / 'locked' / 'c.txt').write_bytes(b'c\n')
+    (tmp_path / 'link.txt').symlink_to(tmp_path / 'a.txt')
+    (tmp_path / 'linkdir').symlink_to(tmp_path / 'sub', target_is_directory=True)
+
+    # We may be root, so refuse the directory rather than chmod it
+    scandir = os.scandir
+    def refuse_locked(path):
+        if path == str(tmp_path / 'locked'):
+            raise PermissionError(13, 'Permission denied', path)
+        return scandir(path)
+    monkeypatch.setattr(os, 'scandir', refuse_locked)
+
+    grep = _load(tmp_path, monkeypatch, b'a\n')
+    assert sorted(grep.codebases['t'].paths) == [str(tmp_path / 'a.txt'), str(tmp_path / 'sub' / 'b.txt')]